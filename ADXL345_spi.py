@@ -1,15 +1,105 @@
 from micropython import const
+import micropython
 import time
 from math import floor, ceil
 import ustruct
 import gc
-from machine import SPI, Pin
+from array import array
+from machine import SPI, Pin, mem32
+try:
+  from ulab import numpy as np
+except ImportError:  # firmware built without ulab: only xyzbytes2g is available
+  np = None
 
 # TODO: const also on non bytes?
 
+# ESP32 GPIO output set/clear registers, for pins 0-31 and 32-39 (other SoC variants have different addresses)
+_GPIO_OUT_W1TS_REG  = const(0x3FF44008)
+_GPIO_OUT_W1TC_REG  = const(0x3FF4400C)
+_GPIO_OUT1_W1TS_REG = const(0x3FF44014)
+_GPIO_OUT1_W1TC_REG = const(0x3FF44018)
+
+
+# source of read_many_xyz acquisition loop, specialised through exec with the constants of an instance as literals
+_READ_MANY_XYZ_SRC = """
+@micropython.native
+def _read(n, r2, spi_write, spi_readinto, addr_bytes, windows, T, t_start):
+  mem32_ = mem32
+  ticks_us_ = ticks_us
+  ticks_diff_ = ticks_diff
+  n_act_meas = 0
+  t_prev = t_start
+  while n_act_meas < n:
+    mem32_[{gpio_w1tc}] = {cs_mask}
+    spi_readinto(r2, {regaddr_intsource})
+    is_data_ready = r2[1] >> 7 & 1
+    mem32_[{gpio_w1ts}] = {cs_mask}
+    if not is_data_ready:
+      continue
+    mem32_[{gpio_w1tc}] = {cs_mask}
+    spi_write(addr_bytes)
+    spi_readinto(windows[n_act_meas])
+    mem32_[{gpio_w1ts}] = {cs_mask}
+    now = ticks_us_()
+    T[n_act_meas] = ticks_diff_(now, t_prev)
+    t_prev = now
+    n_act_meas += 1
+  return n_act_meas, t_prev
+"""
+
+
+@micropython.viper
+def _unpack_xyz(buf, x: ptr16, y: ptr16, z: ptr16):
+  """
+  split the little endian xyz rows of buf into the three int16 buffers x, y, z
+  sign extension is branchless: flipping the sign bit and subtracting it maps 0x8000..0xFFFF to -32768..-1
+  """
+  n = int(len(buf)) // 6
+  b = ptr8(buf)
+  for i in range(n):
+    j = i * 6
+    v = b[j] | (b[j + 1] << 8)
+    x[i] = (v ^ 0x8000) - 0x8000
+    v = b[j + 2] | (b[j + 3] << 8)
+    y[i] = (v ^ 0x8000) - 0x8000
+    v = b[j + 4] | (b[j + 5] << 8)
+    z[i] = (v ^ 0x8000) - 0x8000
+
+
+@micropython.viper
+def _read_fifo_rows(ctx, windows, start: int, nrows: int) -> int:
+  """
+  read nrows measures from the fifo into windows[start:start + nrows], one CS-framed transaction per measure: only
+    the first byte after CS falls is a command, so a new measure can't be addressed without raising CS
+  CS is driven writing cs_mask straight into the GPIO clear (low) and set (high) registers, which is fast enough to
+    break the minimum CS high time, so CS is held high 5 us after each measure: this also gives the fifo the time
+    to pop before the next read
+  :param ctx: (spi.write, spi.readinto, address bytes, array('L') of GPIO clear register, set register, CS mask),
+    packed because older viper emitters don't take more than 4 arguments
+  :return: index of the first window not written
+  """
+  spi_write = ctx[0]
+  spi_readinto = ctx[1]
+  addr = ctx[2]
+  regs = ptr32(ctx[3])
+  cs_low = ptr32(regs[0])
+  cs_high = ptr32(regs[1])
+  cs_mask = regs[2]
+  i = start
+  stop = start + nrows
+  while i < stop:
+    cs_low[0] = cs_mask
+    spi_write(addr)
+    spi_readinto(windows[i])
+    cs_high[0] = cs_mask
+    time.sleep_us(5)
+    i += 1
+  return i
+
+
 class Accelerometer:
   
-  def __init__(self, cs_pin=5, scl_pin=18, sda_pin=23, sdo_pin=19, spi_freq=5000000):
+  def __init__(self, cs_pin=5, scl_pin=18, sda_pin=23, sdo_pin=19, spi_freq=5000000, int1_pin=None):
     """
     Class for fast SPI comunications between an ESP32 flashed with MicroPython and an Analog Devices ADXL345
       accelerometer
@@ -18,6 +108,8 @@ class Accelerometer:
     :param sda_pin: MCU pin number at which accelerometer's SDA wire is connected (MOSI)
     :param sdo_pin: MCU pin number at which accelerometer's SDO wire is connected (MISO)
     :param spi_freq: frequency of SPI comunications
+    :param int1_pin: MCU pin number at which accelerometer's INT1 wire is connected, needed only by
+      start_watermark_irq
     """
 
     # valid inputs
@@ -39,17 +131,27 @@ class Accelerometer:
     self.regaddr_acc        = const(0x32)
     self.regaddr_freq       = const(0x2C)
     self.regaddr_pwr        = const(0x2D)
+    self.regaddr_intenable  = const(0x2E)
+    self.regaddr_intmap     = const(0x2F)
     self.regaddr_intsource  = const(0x30)
     self.regaddr_grange     = const(0x31)
     self.regaddr_fifoctl    = const(0x38)
     self.regaddr_fifostatus = const(0x39)
 
+    # command bytes of the registers read during acquisitions, built once
+    regaddrs = (self.regaddr_acc, self.regaddr_intsource, self.regaddr_fifostatus)
+    self._wbyte_single = {a: a | self.read_mask for a in regaddrs}
+    self._wbyte_multi = {a: a | self.read_mask | self.multibyte_mask for a in regaddrs}
+    self._cmd_bytes = {a: bytes([wbyte]) for a, wbyte in self._wbyte_multi.items()}
+    self._r2 = bytearray(2)  # dummy + one register, reused by every single byte read
+
     # SPI pins
     self.cs_pin = cs_pin
     self.scl_pin = scl_pin
     self.sdo_pin = sdo_pin
     self.sda_pin = sda_pin
     self.spi_freq = spi_freq
+    self.int1_pin = int1_pin
 
     # allowed values
     self.power_modes = {'standby': 0x00, 'measure': 0x08}
@@ -59,6 +161,9 @@ class Accelerometer:
       1600: 0x0e, 3200: 0x0f
     }
 
+    # buffers reused by repeated acquisitions of the same size
+    self._buf_pool = {}
+
   def __del__(self):
     self.spi.deinit()
 
@@ -70,6 +175,20 @@ class Accelerometer:
     )
     time.sleep(0.2)
     self.cs = Pin(self.cs_pin, Pin.OUT, value=1)
+    # the acquisition loops set CS through the GPIO registers, skipping the Pin driver
+    if self.cs_pin < 32:
+      self._cs_mask = 1 << self.cs_pin
+      self._gpio_w1ts = _GPIO_OUT_W1TS_REG
+      self._gpio_w1tc = _GPIO_OUT_W1TC_REG
+    else:
+      self._cs_mask = 1 << (self.cs_pin - 32)
+      self._gpio_w1ts = _GPIO_OUT1_W1TS_REG
+      self._gpio_w1tc = _GPIO_OUT1_W1TC_REG
+    self._fifo_ctx = (
+      self.spi.write, self.spi.readinto, self._cmd_bytes[self.regaddr_acc],
+      array('L', (self._gpio_w1tc, self._gpio_w1ts, self._cs_mask))
+    )  # arguments of _read_fifo_rows
+    self._read_many_xyz_loop = self._build_reader()  # compiled here, far from any acquisition
     time.sleep(0.2)
     if not self.is_spi_communcation_working():
       print(
@@ -111,6 +230,18 @@ class Accelerometer:
     self.cs.value(1)
     return value
 
+  @micropython.native
+  def _read_byte(self, regaddr: int) -> int:
+    """
+    read one byte from register into a preallocated buffer, allocation free
+    :param regaddr: register address to read, one of those in self._wbyte_single
+    :return: byte read
+    """
+    self.cs.value(0)
+    self.spi.readinto(self._r2, self._wbyte_single[regaddr])
+    self.cs.value(1)
+    return self._r2[1]
+
   @micropython.native
   def read_into(self, buf: bytearray, regaddr: int) -> bytearray:
     """
@@ -125,6 +256,49 @@ class Accelerometer:
     self.cs.value(1)
     return buf
 
+  def _get_buffers(self, n_bytes:int, n_times:int, typecode:str='L') -> tuple:
+    """
+    get from the pool an output bytearray of n_bytes, the list of its views one measure wide and an array of n_times
+      times, allocating them only the first time that size is requested
+    :param typecode: typecode of the times array
+    """
+    key = (n_bytes, n_times, typecode)
+    buf, windows, T = self._buf_pool.get(key, (None, None, None))
+    if buf is None:
+      bytes_per_3axes = self.bytes_per_3axes
+      buf = bytearray(n_bytes)
+      m = memoryview(buf)
+      windows = [m[i * bytes_per_3axes: (i + 1) * bytes_per_3axes] for i in range(n_bytes // bytes_per_3axes)]
+      T = array(typecode, bytes(ustruct.calcsize(typecode) * n_times))  # raw ints, no int object per sample
+      self._buf_pool[key] = (buf, windows, T)
+    return buf, windows, T
+
+  def _build_reader(self):
+    """
+    compile the read_many_xyz acquisition loop of this instance, with the INT_SOURCE command byte and the CS
+      registers written as literals, so each sample runs no attribute loads nor lookups on them
+    """
+    src = _READ_MANY_XYZ_SRC.format(
+      regaddr_intsource=self._wbyte_single[self.regaddr_intsource], cs_mask=self._cs_mask,
+      gpio_w1tc=self._gpio_w1tc, gpio_w1ts=self._gpio_w1ts
+    )
+    namespace = {'micropython': micropython, 'mem32': mem32, 'ticks_us': time.ticks_us, 'ticks_diff': time.ticks_diff}
+    exec(src, namespace)
+    return namespace['_read']
+
+  def _times_typecode(self) -> str:
+    """
+    :return: typecode of the narrowest array holding the us between two samples at the current sampling rate
+    """
+    return 'H' if self.sampling_rate >= 50 else 'L'  # 'H' holds up to 65 ms, 3 periods at 50 Hz
+
+  def release(self):
+    """
+    free the buffers kept for repeated acquisitions
+    """
+    self._buf_pool = {}
+    return self
+
   @micropython.native
   def remove_first_bytes_from_bytearray_of_many_transactions(self, buf:bytearray) -> bytearray:
     """
@@ -133,7 +307,14 @@ class Accelerometer:
     :return: bytearray of size multiple of self.bytes_per_3axes
     """
     bytes_per_3axes = self.bytes_per_3axes
-    return bytearray([b for i, b in enumerate(buf) if i % (bytes_per_3axes + 1) != 0])
+    step = bytes_per_3axes + 1
+    n = len(buf) // step
+    out = bytearray(bytes_per_3axes * n)
+    mv_in = memoryview(buf)
+    mv_out = memoryview(out)
+    for i in range(n):  # slice assignment copies the whole row in C instead of one byte at a time
+      mv_out[i * bytes_per_3axes: (i + 1) * bytes_per_3axes] = mv_in[i * step + 1: (i + 1) * step]
+    return out
 
   # == settings ==
   def set_power_mode(self, mode:str):
@@ -176,10 +357,7 @@ class Accelerometer:
       b = 0x00
       print("set fifo in bypass mode")
     else:  # stream mode
-      stream_bstr = '100'
-      wm_bstr = bin(watermark_level).split('b')[1]
-      bstr = '0b' + stream_bstr + '{:>5}'.format(wm_bstr).replace(' ', '0')
-      b = int(bstr, 2)
+      b = 0x80 | (watermark_level & 0x1F)  # stream mode is 0b100 in the 3 upper bits, watermark in the lower 5
       print("set fifo in stream mode")
     self.write(self.regaddr_fifoctl, b)
     return self
@@ -191,10 +369,7 @@ class Accelerometer:
     print('set watermark to %s rows' % (nrows))
     self.fifo_mode = 'stream'
     self.watermark_level = nrows
-    stream_bstr = '100'
-    wm_bstr = bin(nrows).split('b')[1]
-    bstr = '0b' + stream_bstr + '{:>5}'.format(wm_bstr).replace(' ', '0')
-    b = int(bstr, 2)
+    b = 0x80 | (nrows & 0x1F)  # stream mode is 0b100 in the 3 upper bits, watermark in the lower 5
     self.write(self.regaddr_fifoctl, b)
     return self
 
@@ -222,21 +397,21 @@ class Accelerometer:
     """
     :return: 1 if watermark level of measures was reached since last reading, 0 otherwise
     """
-    return self.read(self.regaddr_intsource, 1)[0] >> 1 & 1  # second bit
+    return self._read_byte(self.regaddr_intsource) >> 1 & 1  # second bit
 
   @micropython.native
   def is_data_ready(self) -> bool:
     """
     :return: 1 if a new measure has arrived since last reading, 0 otherwise
     """
-    return self.read(self.regaddr_intsource, 1)[0] >> 7 & 1  # eighth bit
+    return self._read_byte(self.regaddr_intsource) >> 7 & 1  # eighth bit
 
   @micropython.native
   def get_nvalues_in_fifo(self) -> int:
     """
     :return: number of measures (xyz counts 1) in the fifo since last reading
     """
-    return self.read(self.regaddr_fifostatus, 1)[0] & 0x3f  # first six bits to int
+    return self._read_byte(self.regaddr_fifostatus) & 0x3f  # first six bits to int
 
   # == continuos readings able to reach 3.2 kHz ==
   @micropython.native
@@ -245,55 +420,124 @@ class Accelerometer:
     :param n: number of xyz accelerations to read from the accelerometer
     return: (
         bytearray containing 2 bytes for each of the 3 axes multiplied by the fractions of the sampling rate contained in the acquisition time,
-        array of times at which each sample was recorded in microseconds
+        array of microseconds elapsed since the previous sample (since t_start for the first one), see iter_ticks,
+        ticks_us at which the acquisition started
+    )
+    the returned bytearray and times array are the pooled buffers of this size, not copies: the next acquisition of
+      the same size overwrites them, so convert or copy them before (or call release() to detach them from the pool)
+    """
+    print("Measuring %s samples at %s Hz, range %sg" % (n, self.sampling_rate, self.g_range))
+    # local variables and functions are MUCH faster
+    addr_bytes = self._cmd_bytes[self.regaddr_acc]
+    ticks_diff = time.ticks_diff
+    bytes_per_3axes = self.bytes_per_3axes
+    reader = self._read_many_xyz_loop
+    # definitions
+    n_exp_meas = n
+    n_exp_bytes = bytes_per_3axes * n_exp_meas
+    # one preallocated view per sample, so that the loop indexes them instead of slicing
+    buf, windows, T = self._get_buffers(n_exp_bytes, n_exp_meas, self._times_typecode())
+    # set up device
+    self.set_fifo_mode('bypass')
+    # measure
+    gc.collect()  # only collection of the acquisition: none must happen while measuring
+    self.set_power_mode('measure')
+    t_start = time.ticks_us()
+    # address phase apart from the data read, so no dummy byte lands in buf
+    n_act_meas, t_prev = reader(
+      n_exp_meas, self._r2, self.spi.write, self.spi.readinto, addr_bytes, windows, T, t_start
     )
+    self.set_power_mode('standby')
+    # debug
+    actual_acq_time = (ticks_diff(t_prev, t_start) - T[0]) / 1000000  # from first to last sample
+    print('measured for %s seconds, expected %s seconds' % (actual_acq_time, n_exp_meas/self.sampling_rate))
+    print('avg sampling rate = ' + str(n_act_meas / actual_acq_time) + ' Hz')
+    # TODO: send error to webapp when actual acquisition time is different from expected
+    return buf, T, t_start
+
+  @micropython.native
+  def read_many_xyz_paced(self, n:int, check_every:int=32) -> tuple:
+    """
+    read many measures of acceleration on the 3 axes pacing the readings on the sampling rate instead of polling
+      the data ready bit before each of them: only one SPI transaction per sample
+    :param n: number of xyz accelerations to read from the accelerometer
+    :param check_every: the data ready bit is waited for once every check_every samples to resync with the device;
+      with values <= 0 it is waited for only before the first sample
+    after each resync the following reads are aimed at the middle of the sampling periods, with deadlines computed
+      on the exact sampling rate: MCU and device clocks may drift apart by up to half a period (minus the few tens
+      of us of a read) over check_every samples, e.g. 150 us every 32 samples at 3200 Hz, before a measure is read
+      twice or skipped
+    return: (
+        bytearray containing 2 bytes for each of the 3 axes multiplied by the fractions of the sampling rate contained in the acquisition time,
+        array of microseconds elapsed since the previous sample (since t_start for the first one), see iter_ticks,
+        ticks_us at which the acquisition started
+    )
+    the returned bytearray and times array are the pooled buffers of this size, not copies: the next acquisition of
+      the same size overwrites them, so convert or copy them before (or call release() to detach them from the pool)
     """
     print("Measuring %s samples at %s Hz, range %sg" % (n, self.sampling_rate, self.g_range))
     # local variables and functions are MUCH faster
-    regaddr_acc = self.regaddr_acc | self.read_mask | self.multibyte_mask
-    regaddr_intsource = self.regaddr_intsource | self.read_mask
+    addr_bytes = self._cmd_bytes[self.regaddr_acc]
     spi_readinto = self.spi.readinto
-    cs = self.cs
+    spi_write = self.spi.write
+    cs_mask = self._cs_mask
+    gpio_w1ts = self._gpio_w1ts
+    gpio_w1tc = self._gpio_w1tc
     ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+    ticks_add = time.ticks_add
+    is_data_ready = self.is_data_ready
     bytes_per_3axes = self.bytes_per_3axes
-    read = self.spi.read
+    # period of 1e8 / (100 * sampling rate) us, as integer part plus a remainder accumulated over the samples
+    sr100 = int(self.sampling_rate * 100 + 0.5)
+    period, period_rem = divmod(100000000, sr100)
+    half_period = period // 2
     # definitions
     n_exp_meas = n
-    n_exp_bytes = (self.bytes_per_3axes + 1) * n_exp_meas
-    T = [0] * (int(n_exp_meas * 1.5))
-    buf = bytearray(int(n_exp_bytes * 1.5))
-    m = memoryview(buf)
+    n_exp_bytes = bytes_per_3axes * n_exp_meas
+    if check_every <= 0:
+      check_every = n_exp_meas + 1  # never resync after the first sample
+    # one preallocated view per sample, so that the loop indexes them instead of slicing
+    buf, windows, T = self._get_buffers(n_exp_bytes, n_exp_meas, self._times_typecode())
     # set up device
     self.set_fifo_mode('bypass')
-    gc.collect()
     # measure
     n_act_meas = 0
+    gc.collect()  # only collection of the acquisition: none must happen while measuring
     self.set_power_mode('measure')
+    t_start = ticks_us()
+    t_prev = t_start
+    t_next = t_start
+    rem = 0
     while n_act_meas < n_exp_meas:
-      start_index = n_act_meas * (bytes_per_3axes + 1)
-      stop_index = n_act_meas * (bytes_per_3axes + 1) + (bytes_per_3axes + 1)
-      cs.value(0)
-      is_data_ready = read(2, regaddr_intsource)[1] >> 7 & 1
-      cs.value(1)
-      if not is_data_ready:
-        continue
-      cs.value(0)
-      spi_readinto(m[start_index: stop_index], regaddr_acc)
-      cs.value(1)
-      T[n_act_meas] = ticks_us()
+      if n_act_meas % check_every == 0:
+        while not is_data_ready():
+          pass
+        t_next = ticks_add(ticks_us(), half_period)  # following reads land mid-period, away from data updates
+        rem = 0
+      else:
+        while ticks_diff(t_next, ticks_us()) > 0:
+          pass
+      mem32[gpio_w1tc] = cs_mask
+      spi_write(addr_bytes)  # address phase apart, so no dummy byte lands in buf
+      spi_readinto(windows[n_act_meas])
+      mem32[gpio_w1ts] = cs_mask
+      now = ticks_us()
+      T[n_act_meas] = ticks_diff(now, t_prev)
+      t_prev = now
+      rem += period_rem
+      if rem >= sr100:
+        rem -= sr100
+        t_next = ticks_add(t_next, period + 1)
+      else:
+        t_next = ticks_add(t_next, period)
       n_act_meas += 1
     self.set_power_mode('standby')
-    # final corrections
-    buf = self.remove_first_bytes_from_bytearray_of_many_transactions(buf)
-    buf = buf[:n_exp_meas * bytes_per_3axes]  # remove exceeding values
-    T = T[:n_exp_meas]  # remove exceeding values
     # debug
-    actual_acq_time = (T[-1] - T[0]) / 1000000
+    actual_acq_time = (ticks_diff(t_prev, t_start) - T[0]) / 1000000  # from first to last sample
     print('measured for %s seconds, expected %s seconds' % (actual_acq_time, n_exp_meas/self.sampling_rate))
     print('avg sampling rate = ' + str(n_act_meas / actual_acq_time) + ' Hz')
-    # TODO: send error to webapp when actual acquisition time is different from expected
-    gc.collect()
-    return buf, T
+    return buf, T, t_start
 
   @micropython.native
   def read_many_xyz_fromfifo(self, n: int) -> tuple:
@@ -304,39 +548,37 @@ class Accelerometer:
         bytearray containing 2 bytes for each of the 3 axes multiplied by the fractions of the sampling rate contained in the acquisition time,
         array of times at which each sample was recorded in microseconds
     )
+    the returned bytearray is the pooled buffer of this size, not a copy: the next acquisition of the same size
+      overwrites it, so convert or copy it before (or call release() to detach it from the pool)
     """
     print("Measuring %s samples at %s Hz, range %sg" % (n, self.sampling_rate, self.g_range))
     # local variables and functions are MUCH faster
-    regaddr_acc = self.regaddr_acc | self.read_mask | self.multibyte_mask
-    spi_readinto = self.spi.readinto
-    cs = self.cs
+    fifo_ctx = self._fifo_ctx
     get_nvalues_in_fifo = self.get_nvalues_in_fifo
+    read_fifo_rows = _read_fifo_rows
     bytes_per_3axes = self.bytes_per_3axes
     # definitions
     n_exp_meas = n
-    n_exp_bytes = (bytes_per_3axes + 1) * n_exp_meas
-    buf = bytearray(int(n_exp_bytes * 1.5))
-    m = memoryview(buf)
+    n_exp_bytes = bytes_per_3axes * n_exp_meas
+    # one preallocated view per sample, so that the loop indexes them instead of slicing
+    buf, windows, _ = self._get_buffers(n_exp_bytes, 0)
     # set up device
     self.set_fifo_mode('stream')
-    gc.collect()
     # measure
     n_act_meas = 0
+    gc.collect()  # only collection of the acquisition: none must happen while measuring
     self.set_power_mode('measure')
     self.clear_fifo()
     t_start = time.ticks_us()
     while n_act_meas < n_exp_meas:
       nvalues_infifo = get_nvalues_in_fifo()
-      for _ in range(nvalues_infifo):  # it is impossible to read a block of measures from fifo
-        cs.value(0)
-        spi_readinto(m[n_act_meas * (bytes_per_3axes + 1): n_act_meas * (bytes_per_3axes + 1) + (bytes_per_3axes + 1)], regaddr_acc)
-        cs.value(1)
-        n_act_meas += 1
+      if nvalues_infifo > n_exp_meas - n_act_meas:
+        nvalues_infifo = n_exp_meas - n_act_meas  # measures exceeding n stay in the fifo and are dropped
+      # it is impossible to read a block of measures from fifo: the loop over them runs in viper
+      n_act_meas = read_fifo_rows(fifo_ctx, windows, n_act_meas, nvalues_infifo)
     t_stop = time.ticks_us()
     self.set_power_mode('standby')
     # final corrections
-    buf = self.remove_first_bytes_from_bytearray_of_many_transactions(buf)
-    buf = buf[:n_exp_meas * bytes_per_3axes]  # remove exceeding values
     actual_acq_time = (t_stop - t_start) / 1000000
     actual_sampling_rate = n_act_meas / actual_acq_time
     T = [(i+1) / actual_sampling_rate for i in range(n_exp_meas)]
@@ -344,7 +586,6 @@ class Accelerometer:
     print('measured for %s seconds, expected %s seconds' % (actual_acq_time, n/self.sampling_rate))
     print('actual sampling rate = ' + str(n_act_meas / actual_acq_time) + ' Hz')
     # TODO: send error to webapp when actual acquisition time is different from expected
-    gc.collect()
     return buf, T
 
   @micropython.native
@@ -355,12 +596,14 @@ class Accelerometer:
     :param acquisition_time: seconds the acquisition should last
     :return: (
         bytearray containing 2 bytes for each of the 3 axes multiplied by the fractions of the sampling rate contained in the acquisition time,
-        array of times at which each sample was recorded in microseconds
+        array of microseconds elapsed since the previous sample (since t_start for the first one), see iter_ticks,
+        ticks_us at which the acquisition started
     )
+    the returned buffers are overwritten by the next acquisition of the same size, see read_many_xyz
     """
     n_exp_meas = int(acquisition_time * self.sampling_rate)
-    buf, T = self.read_many_xyz(n_exp_meas)
-    return buf, T
+    buf, T, t_start = self.read_many_xyz(n_exp_meas)
+    return buf, T, t_start
 
   @micropython.native
   def read_continuos_xyz_fromfifo(self, acquisition_time: int) -> tuple:
@@ -371,25 +614,112 @@ class Accelerometer:
         bytearray containing 2 bytes for each of the 3 axes multiplied by the fractions of the sampling rate contained in the acquisition time,
         array of times at which each sample was recorded in microseconds
     )
+    the returned bytearray is overwritten by the next acquisition of the same size, see read_many_xyz_fromfifo
     """
     n_exp_meas = int(acquisition_time * self.sampling_rate)
     buf, T = self.read_many_xyz_fromfifo(n_exp_meas)
     return buf, T
 
+  # == interrupt driven readings ==
+  def start_watermark_irq(self, callback, watermark_level:int=16):
+    """
+    start an acquisition driven by the fifo watermark interrupt on INT1: the MCU is free while the fifo fills up,
+      then the fifo is drained into one of two buffers and callback is called with it while the other one is used
+      by the next drain
+    :param callback: function called (outside of the ISR) with a memoryview on the measures just drained, 2 bytes
+      for each of the 3 axes per measure; the view is overwritten by the next but one drain, so convert or copy it
+      within the callback
+    :param watermark_level: number of measures in the fifo triggering the interrupt
+    """
+    if self.int1_pin is None:
+      raise ValueError('int1_pin must be given to use the watermark interrupt')
+    bytes_per_3axes = self.bytes_per_3axes
+    n_max_meas = self.nmaxvalues_infifo + 1  # a full fifo + output regs
+    # double buffer; the ISR can't allocate, and everything the drain uses is allocated here as well, so that
+    #   draining doesn't fragment the heap: bound methods, one view per measure and one view per drained length
+    self._irq_bufs = (bytearray(bytes_per_3axes * n_max_meas), bytearray(bytes_per_3axes * n_max_meas))
+    views = tuple(memoryview(buf) for buf in self._irq_bufs)
+    self._irq_windows = tuple(
+      [m[i * bytes_per_3axes: (i + 1) * bytes_per_3axes] for i in range(n_max_meas)] for m in views
+    )
+    self._irq_chunks = tuple([m[:i * bytes_per_3axes] for i in range(n_max_meas + 1)] for m in views)
+    self._irq_wr = 0
+    self._irq_callback = callback
+    self._drain_fifo_ref = self._drain_fifo
+    self._get_nvalues_in_fifo_ref = self.get_nvalues_in_fifo
+    self._is_watermark_reached_ref = self.is_watermark_reached
+    # set up device
+    self.set_fifo_mode('bypass')  # empty fifo, so INT1 starts low and the first rising edge is not missed
+    self.set_fifo_mode('stream', watermark_level)
+    self.write(self.regaddr_intmap, 0x00)  # all interrupts on INT1
+    self.write(self.regaddr_intenable, 0x02)  # watermark interrupt only
+    self.int1 = Pin(self.int1_pin, Pin.IN)
+    self.int1.irq(trigger=Pin.IRQ_RISING, handler=self._on_watermark)
+    self.set_power_mode('measure')
+    return self
+
+  def stop_watermark_irq(self):
+    """
+    stop the acquisition started by start_watermark_irq
+    """
+    self.int1.irq(handler=None)
+    self.write(self.regaddr_intenable, 0x00)
+    self.set_power_mode('standby')
+    return self
+
+  def _on_watermark(self, pin):
+    micropython.schedule(self._drain_fifo_ref, None)
+
+  @micropython.native
+  def _drain_fifo(self, _):
+    """
+    read all the measures in the fifo into the buffer not in use and pass them to the callback, then swap buffers;
+      repeat until the fifo is below the watermark, otherwise INT1 stays high and no more rising edges arrive
+    """
+    get_nvalues_in_fifo = self._get_nvalues_in_fifo_ref
+    is_watermark_reached = self._is_watermark_reached_ref
+    while True:
+      wr = self._irq_wr
+      n_read = _read_fifo_rows(self._fifo_ctx, self._irq_windows[wr], 0, get_nvalues_in_fifo())
+      self._irq_wr = 1 - wr
+      self._irq_callback(self._irq_chunks[wr][n_read])
+      if not is_watermark_reached():
+        break
+
   # == conversions ==
+  def iter_ticks(self, T, t_start:int):
+    """
+    yield the absolute ticks_us of each sample from the times returned by read_many_xyz and read_many_xyz_paced
+    :param T: array of microseconds elapsed since the previous sample
+    :param t_start: ticks_us at which the acquisition started
+    """
+    t = t_start
+    for dt in T:
+      t = time.ticks_add(t, dt)
+      yield t
+
   def xyzbytes2g(self, buf:bytearray) -> tuple:
     """
-    convert a bytearray of measures on the three axes xyz in three lists where the acceleration is in units of
+    convert a bytearray of measures on the three axes xyz in three arrays where the acceleration is in units of
         gravity on the sealevel (g)
     :param buf: bytearray of 2 bytes * 3 axes * nvalues
-    :return: 3 lists of ints corresponding to x, y, z values of acceleration in units of g
-    """
-    gc.collect()
-    n_act_meas = int(len(buf)/self.bytes_per_3axes)
-    acc_x, acc_y, acc_z = zip(*[ustruct.unpack('<HHH', buf[i:i + self.bytes_per_3axes]) for i in range(n_act_meas) if i % self.bytes_per_3axes == 0])
-    # negative values rule
-    acc_x = [x if x <= 32767 else x - 65536 for x in acc_x]
-    acc_y = [y if y <= 32767 else y - 65536 for y in acc_y]
-    acc_z = [z if z <= 32767 else z - 65536 for z in acc_z]
-    gc.collect()
+    :return: 3 arrays of signed ints corresponding to x, y, z values of acceleration in units of g
+    """
+    n_act_meas = len(buf) // self.bytes_per_3axes
+    acc_x = array('h', bytes(2 * n_act_meas))
+    acc_y = array('h', bytes(2 * n_act_meas))
+    acc_z = array('h', bytes(2 * n_act_meas))
+    _unpack_xyz(buf, acc_x, acc_y, acc_z)
     return acc_x, acc_y, acc_z
+
+  def xyzbytes2g_np(self, buf:bytearray) -> tuple:
+    """
+    like xyzbytes2g but decoding with ulab, on firmwares including it: no loop over the measures is run, the
+      returned ndarrays are views on buf, so buf must be kept (and not modified) as long as they are used
+    :param buf: bytearray of 2 bytes * 3 axes * nvalues
+    :return: 3 int16 ndarrays corresponding to x, y, z values of acceleration in units of g
+    """
+    if np is None:
+      raise ImportError('ulab is not available on this firmware, use xyzbytes2g')
+    acc = np.frombuffer(buf, dtype=np.int16).reshape((len(buf) // self.bytes_per_3axes, 3))
+    return acc[:, 0], acc[:, 1], acc[:, 2]